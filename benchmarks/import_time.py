@@ -0,0 +1,62 @@
+"""Check the import time of each `rai` subcommand against its budget.
+
+Runs `python -X importtime` in a fresh interpreter for every subcommand in
+rai.cli.COMMAND_MODULES and exits with a non-zero status if any of them
+exceeds its budget in rai.cli.IMPORT_BUDGETS_MS.
+
+Usage, with rai installed (`pip install -e .`):
+
+    python benchmarks/import_time.py [subcommand ...]
+"""
+from typing import List
+import subprocess
+import sys
+
+from rai.cli import COMMAND_MODULES, IMPORT_BUDGETS_MS
+
+
+def measure_import_time(code: str) -> float:
+    """Return the total time, in milliseconds, that `python -c code` spends
+    importing modules, including those imported at interpreter startup."""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          capture_output=True,
+                          text=True,
+                          check=True)
+    total_us = 0
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, package = line[len('import time:'):].split('|')
+        # nested imports are indented and already counted by their parent
+        if not cumulative.strip().isdigit() or package.startswith('  '):
+            continue
+        total_us += int(cumulative)
+    return total_us / 1e3
+
+
+def measure_command_import_time(command: str, startup_ms: float) -> float:
+    """Return the import time of `rai.cli` and command's modules in
+    milliseconds, excluding interpreter startup."""
+    code = f'import rai.cli; rai.cli.load_command({command!r})'
+    return measure_import_time(code) - startup_ms
+
+
+def main(commands: List[str]) -> int:
+    if len(commands) == 0:
+        commands = list(COMMAND_MODULES)
+    startup_ms = measure_import_time('pass')
+    over_budget = []
+    for command in commands:
+        import_ms = measure_command_import_time(command, startup_ms)
+        budget_ms = IMPORT_BUDGETS_MS[command]
+        status = 'ok' if import_ms <= budget_ms else 'OVER BUDGET'
+        print(f'{command:<12}{import_ms:>10.1f} ms / {budget_ms:>7.0f} ms  '
+              f'{status}')
+        if import_ms > budget_ms:
+            over_budget.append(command)
+    return 1 if len(over_budget) > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,239 @@
+"""Command line interface for the RAI toolkit.
+
+Every subcommand imports its heavy dependencies only when it runs, so that
+e.g. `rai preprocess` or `rai geocode --inspect` do not pay for osmnx. The
+modules each subcommand needs are listed in COMMAND_MODULES and their
+import time is checked against IMPORT_BUDGETS_MS by
+benchmarks/import_time.py.
+"""
+from typing import Callable, Dict, List, Optional, Tuple
+import argparse
+import os
+from importlib import import_module
+
+from rai.defaults import PROCESSED_LENGTH_COL, ENDPOINT_COLS
+
+COMMAND_MODULES: Dict[str, Tuple[str, ...]] = {
+    'preprocess': ('pandas', 'rai.preprocess'),
+    'geocode': ('rai.geocode', ),
+    'match': ('pandas', 'geopandas', 'osmnx', 'rai.geocode', 'rai.match',
+              'rai.preprocess', 'rai.route'),
+    'rai': ('rasterio', 'rai.index'),
+    'serve': ('rai.service', ),
+}
+
+# upper bounds on the time it takes to import each subcommand's modules,
+# as reported by `python -X importtime`
+IMPORT_BUDGETS_MS: Dict[str, float] = {
+    'preprocess': 1000,
+    'geocode': 400,
+    'match': 5000,
+    'rai': 1000,
+    'serve': 1000,
+}
+
+
+def load_command(command: str) -> None:
+    for module in COMMAND_MODULES[command]:
+        import_module(module)
+
+
+def run_preprocess(args: argparse.Namespace) -> None:
+    import pandas as pd
+    from rai.preprocess import get_country_preprocesor
+
+    df = pd.read_csv(args.input_csv)
+    preprocessor = get_country_preprocesor(args.country)(df)
+    preprocessor.run()
+    preprocessor.df.to_csv(args.output_csv, index=False)
+
+
+def make_geocoder(args: argparse.Namespace):
+    from rai.geocode import make_geocoder
+
+    return make_geocoder(
+        cache_path=args.cache,
+        geonames_csv=args.geonames_csv,
+        username=args.username,
+        country_code=args.country_code)
+
+
+def run_geocode(args: argparse.Namespace) -> None:
+    from rai.geocode import load_cache
+
+    if args.inspect:
+        cache = load_cache(args.cache) if os.path.exists(args.cache) else {}
+        print(f'{len(cache)} cached queries in {args.cache}')
+        queries = args.queries if len(args.queries) > 0 else sorted(cache)
+        for q in queries:
+            names, points = cache.get(q, ([], []))
+            print_geocode_result(q, names, points)
+        return
+
+    with make_geocoder(args) as geocoder:
+        for q in args.queries:
+            names, points = geocoder(q)
+            print_geocode_result(q, names, points)
+
+
+def print_geocode_result(q: str, names: List[str], points: list) -> None:
+    print(f'{q}: {len(points)} result(s)')
+    for name, point in zip(names, points):
+        print(f'    {name} ({point.x:.5f}, {point.y:.5f})')
+
+
+def run_match(args: argparse.Namespace) -> None:
+    import pandas as pd
+    from rai.match import Matcher, match_inventory, save_matches
+    from rai.preprocess import get_country_preprocesor
+    from rai.route import Router
+
+    df = pd.read_csv(args.input_csv)
+    if not args.preprocessed:
+        preprocessor = get_country_preprocesor(args.country)(df)
+        preprocessor.run()
+        df = preprocessor.df
+    missing = [
+        c for c in (*ENDPOINT_COLS, PROCESSED_LENGTH_COL) if c not in df
+    ]
+    if len(missing) > 0:
+        raise ValueError(f'Input is missing columns: {missing}')
+
+    router = Router(args.country, pbf_path=args.pbf)
+    with make_geocoder(args) as geocoder:
+        matcher = Matcher(
+            geocoder,
+            router,
+            max_candidate_routes=args.max_candidate_routes,
+            length_tol=args.length_tol)
+        routes = match_inventory(matcher, df)
+
+    out_dir = args.out_dir or f'out/{args.country}'
+    save_matches(df, routes, out_dir, args.country)
+
+
+def run_rai(args: argparse.Namespace) -> None:
+    from rai.index import calc_rai_from_rasters
+
+    out = calc_rai_from_rasters(args.rural_pop, args.unserved_pop)
+    for k, v in out.items():
+        print(f'{k}: {v}')
+
+
+def run_serve(args: argparse.Namespace) -> None:
+    from rai.service import MatchService, load_region_configs
+
+    memory_cap = None
+    if args.memory_cap_mb is not None:
+        memory_cap = int(args.memory_cap_mb * 2**20)
+    service = MatchService(
+        load_region_configs(args.config),
+        memory_cap=memory_cap,
+        batch_size=args.batch_size,
+        batch_wait=args.batch_wait_ms / 1e3)
+    try:
+        if args.port is not None:
+            service.serve_http(args.host, args.port)
+        else:
+            service.serve_jsonl()
+    finally:
+        service.close()
+
+
+def add_geocoder_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        '--cache', default='geocoder.cache', help='Geocoder cache file.')
+    parser.add_argument(
+        '--geonames-csv',
+        help='GeoNames dump to geocode against offline instead of querying '
+        'the GeoNames API.')
+    parser.add_argument('--username', help='GeoNames API username.')
+    parser.add_argument(
+        '--country-code', help='Restrict API queries to this country.')
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog='rai', description='RAI toolkit command line interface.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser(
+        'preprocess', help='Standardize a country road inventory CSV.')
+    p.add_argument('country')
+    p.add_argument('input_csv')
+    p.add_argument('output_csv')
+    p.set_defaults(func=run_preprocess)
+
+    p = subparsers.add_parser(
+        'geocode', help='Geocode place names or inspect a geocoder cache.')
+    add_geocoder_args(p)
+    p.add_argument(
+        '--inspect',
+        action='store_true',
+        help='Only read results from the cache, without geocoding.')
+    p.add_argument('queries', nargs='*')
+    p.set_defaults(func=run_geocode)
+
+    p = subparsers.add_parser(
+        'match', help='Match road inventory sections to OSM routes.')
+    p.add_argument('country')
+    p.add_argument('input_csv')
+    add_geocoder_args(p)
+    p.add_argument(
+        '--preprocessed',
+        action='store_true',
+        help='The input has already been run through `rai preprocess`.')
+    p.add_argument(
+        '--pbf', help='Build the road graph from this .osm.pbf extract.')
+    p.add_argument('--length-tol', type=float, default=None)
+    p.add_argument('--max-candidate-routes', type=int, default=10)
+    p.add_argument('--out-dir', default=None)
+    p.set_defaults(func=run_match)
+
+    p = subparsers.add_parser(
+        'rai', help='Calculate the RAI from population rasters.')
+    p.add_argument('rural_pop', help='Rural population raster.')
+    p.add_argument(
+        'unserved_pop',
+        help='Rural population raster with the population within reach of '
+        'good roads masked out.')
+    p.set_defaults(func=run_rai)
+
+    p = subparsers.add_parser(
+        'serve',
+        help='Serve match requests from JSONL on stdin or over local HTTP, '
+        'keeping region graphs and geocoders loaded.')
+    p.add_argument(
+        'config',
+        help='JSON file mapping region names to their Router and Geocoder '
+        'arguments.')
+    p.add_argument(
+        '--port',
+        type=int,
+        default=None,
+        help='Serve over HTTP on this port instead of reading stdin.')
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument(
+        '--memory-cap-mb',
+        type=float,
+        default=None,
+        help='Evict least recently used regions above this memory use.')
+    p.add_argument('--batch-size', type=int, default=32)
+    p.add_argument(
+        '--batch-wait-ms',
+        type=float,
+        default=10,
+        help='How long to wait for more requests to batch per region.')
+    p.set_defaults(func=run_serve)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = get_parser().parse_args(argv)
+    func: Callable[[argparse.Namespace], None] = args.func
+    func(args)
+
+
+if __name__ == '__main__':
+    main()
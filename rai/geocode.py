@@ -1,20 +1,20 @@
 from abc import abstractmethod
 from functools import partial
-from typing import Optional, Tuple, List
+from typing import TYPE_CHECKING, Optional, Tuple, List
 import sys
 import os
 from contextlib import AbstractContextManager
 import logging
 
-from geopy import geocoders, Location
-from geopy.extra.rate_limiter import RateLimiter
 from shapely.geometry import Point
 import pickle
 
-from fuzzywuzzy import fuzz
-from fuzzywuzzy import process
+from rai.utils import remove_diacritics, read_geonames_csv, geonames_to_dict
 
-from utils import remove_diacritics, read_geonames_csv, geonames_to_dict
+# geopy and fuzzywuzzy are only imported by the geocoders that use them, so
+# that working with a cache alone stays cheap
+if TYPE_CHECKING:
+    from geopy import Location
 
 CACHE_PATH = 'geocoder.cache'
 
@@ -25,6 +25,11 @@ logging.basicConfig(
 log = logging.getLogger()
 
 
+def load_cache(cache_path: os.PathLike) -> dict:
+    with open(cache_path, 'rb') as f:
+        return pickle.load(f)
+
+
 class Geocoder(AbstractContextManager):
     def __init__(self,
                  cache_path: os.PathLike = CACHE_PATH,
@@ -43,8 +48,7 @@ class Geocoder(AbstractContextManager):
     def load_cache_from_file(self, cache_path: os.PathLike):
         if os.path.exists(cache_path):
             log.info('Loading cache from file ...')
-            with open(cache_path, 'rb') as f:
-                self.cache = pickle.load(f)
+            self.cache = load_cache(cache_path)
 
     def save_cache_to_file(self, cache_path: os.PathLike):
         log.info('Saving cache to file ...')
@@ -67,6 +71,9 @@ class GeoPyGeocoder(Geocoder):
                  query_args: dict = {},
                  cache_path: os.PathLike = CACHE_PATH,
                  max_results: int = 10) -> None:
+        from geopy import geocoders
+        from geopy.extra.rate_limiter import RateLimiter
+
         self.geolocator = getattr(geocoders, service)(
             user_agent='route-app', **service_args)
         _geocode = partial(self.geolocator.geocode, **query_args)
@@ -88,7 +95,7 @@ class GeoPyGeocoder(Geocoder):
             names, points = [], []
         return names, points
 
-    def loc_to_point(self, loc: Location) -> Point:
+    def loc_to_point(self, loc: 'Location') -> Point:
         return Point(loc.longitude, loc.latitude)
 
 
@@ -104,6 +111,9 @@ class CustomGeocoder(Geocoder):
         super().__init__(cache_path=cache_path, max_results=max_results)
 
     def geocode(self, q: str) -> Optional[Tuple[List[str], List[Point]]]:
+        from fuzzywuzzy import fuzz
+        from fuzzywuzzy import process
+
         scorer = self.fuzz_args.get('scorer', None)
         limit = self.fuzz_args.get('limit', 3)
 
@@ -141,6 +151,27 @@ class CustomGeocoder(Geocoder):
         return geocoder
 
 
+def make_geocoder(cache_path: os.PathLike = CACHE_PATH,
+                  geonames_csv: Optional[os.PathLike] = None,
+                  username: Optional[str] = None,
+                  country_code: Optional[str] = None) -> Geocoder:
+    """Return a CustomGeocoder over geonames_csv if given, else a
+    GeoPyGeocoder querying the GeoNames API."""
+    if geonames_csv is not None:
+        return CustomGeocoder.from_geonames_csv(
+            geonames_csv, cache_path=cache_path)
+    service_args = {'timeout': 3}
+    if username is not None:
+        service_args['username'] = username
+    query_args = {}
+    if country_code is not None:
+        query_args['country'] = country_code
+    return GeoPyGeocoder(
+        cache_path=cache_path,
+        service_args=service_args,
+        query_args=query_args)
+
+
 def test_geopy():
     with GeoPyGeocoder(
             service_args={'username': 'ahassan'}, query_args={'country':
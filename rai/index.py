@@ -0,0 +1,32 @@
+from typing import Dict
+import os
+
+import numpy as np
+
+
+def calc_rai(rural_pop_img: np.ndarray,
+             unserved_pop_img: np.ndarray) -> Dict[str, float]:
+    rural_pop = rural_pop_img[rural_pop_img >= 0].sum()
+    unserved_pop = unserved_pop_img[unserved_pop_img >= 0].sum()
+    rai = (rural_pop - unserved_pop) / rural_pop
+    out = {
+        'rural_pop': round(rural_pop),
+        'unserved_pop': round(unserved_pop),
+        'served_pop': round(rural_pop - unserved_pop),
+        'rai': round(100 * rai, 2)
+    }
+    return out
+
+
+def calc_rai_from_rasters(rural_pop_path: os.PathLike,
+                          unserved_pop_path: os.PathLike) -> Dict[str, float]:
+    """Calculate the RAI from a rural population raster and the same raster
+    with the population served by roads masked out, as written by the
+    calc_rai notebook."""
+    import rasterio
+
+    with rasterio.open(rural_pop_path) as src:
+        rural_pop_img = src.read(1)
+    with rasterio.open(unserved_pop_path) as src:
+        unserved_pop_img = src.read(1)
+    return calc_rai(rural_pop_img, unserved_pop_img)
@@ -1,21 +1,24 @@
-from typing import Tuple, Iterable, List, Optional
+from typing import TYPE_CHECKING, Any, Tuple, Iterable, List, Optional
 import sys
 import os
 from itertools import product
 import logging
 
 import numpy as np
-import pandas as pd
-import geopandas as gpd
-from tqdm import tqdm
 
 from shapely.geometry import Point
 
 from rai.utils import geographical_distance
-from rai.geocode import Geocoder, GeoPyGeocoder
-from rai.route import Route, Router
-from rai.preprocess import get_country_preprocesor
+from rai.route import Route
 from rai.defaults import (PROCESSED_LENGTH_COL, ENDPOINT_COLS)
+
+# the geocoders, routers and dataframe libraries are only imported by the
+# code that constructs or writes them
+if TYPE_CHECKING:
+    import pandas as pd
+    from rai.geocode import Geocoder
+    from rai.route import Router
+
 logging.basicConfig(
     stream=sys.stdout,
     level=logging.INFO,
@@ -25,12 +28,16 @@ log = logging.getLogger()
 
 class Matcher():
     def __init__(self,
-                 geocoder: Geocoder,
-                 router: Router,
-                 max_candidate_routes: Optional[int] = 10) -> None:
+                 geocoder: 'Geocoder',
+                 router: 'Router',
+                 max_candidate_routes: Optional[int] = 10,
+                 length_tol: Optional[float] = None) -> None:
         self.geocoder = geocoder
         self.router = router
         self.max_candidate_routes = max_candidate_routes
+        # if set, only routes within length_tol km of the target length are
+        # accepted and searches that cannot produce one are cut short
+        self.length_tol = length_tol
 
     def match(self, p1: str, p2: str, target_length: float) -> Route:
         log.info(f'{p1} -- {p2}')
@@ -48,26 +55,83 @@ class Matcher():
             return Route.null()
 
         log.info(f'{len(candidate_pairs)}')
-        candidate_routes = self.get_candidate_routes(candidate_pairs)
-        matched_route = self.select_best_route(candidate_routes, target_length)
+        if self.length_tol is not None:
+            return self.find_bounded_route(candidate_pairs, target_length,
+                                           self.length_tol)
+
+        candidate_paths, route_lengths = self.get_candidate_paths(
+            candidate_pairs)
+        if len(candidate_paths) == 0:
+            return Route.null()
+        best_idx = self.select_best_route(route_lengths, target_length)
+        matched_route = self.router.path_to_route(
+            candidate_paths[best_idx], float(route_lengths[best_idx]))
         return matched_route
 
-    def select_best_route(self, candidate_routes: List[Route],
-                          target_length: float) -> Route:
-        route_lengths = np.array([r.length for r in candidate_routes])
-        best_route_idx = np.argmin(np.abs(route_lengths - target_length))
-        return candidate_routes[best_route_idx]
+    def find_bounded_route(self, candidate_pairs: List[Tuple[Point, Point]],
+                           target_length: float, tol: float) -> Route:
+        """Route between candidate pairs, in the given order, returning the
+        route whose length is closest to target_length and within tol of it.
+
+        Each search is bounded by the length that would still improve on the
+        best route found so far. Since a route can be no shorter than the
+        straight-line distance between the graph nodes its endpoints snap to,
+        routing stops once no remaining pair can beat the current best.
+        Geometry is only built for the selected route.
+        """
+        router = self.router
+        # bound with the snapped nodes rather than the geocoded points, which
+        # may lie off the road network
+        straight_dists = np.array([
+            geographical_distance(
+                router.node_to_point(router.nearest_node(p1)),
+                router.node_to_point(router.nearest_node(p2)))
+            for p1, p2 in candidate_pairs
+        ])
+        straight_dists /= 1e3
+        # lowest length difference that each pair could possibly achieve
+        lower_bounds = np.maximum(straight_dists - target_length, 0)
+        # lowest such bound among each pair and all the pairs after it
+        remaining_bounds = np.minimum.accumulate(lower_bounds[::-1])[::-1]
+
+        best_path, best_length, best_diff = None, None, tol
+        for (p1, p2), lower_bound in zip(candidate_pairs, remaining_bounds):
+            if best_path is not None and best_diff <= lower_bound:
+                break
+            path, length = self.router.find_path(
+                p1, p2, max_length=target_length + best_diff)
+            if path is None:
+                continue
+            diff = abs(length - target_length)
+            if diff <= best_diff and (best_path is None or diff < best_diff):
+                best_path, best_length, best_diff = path, length, diff
+
+        if best_path is None:
+            return Route.null()
+        return self.router.path_to_route(best_path, best_length)
 
-    def get_candidate_routes(
-            self,
-            candidate_pairs: Iterable[Tuple[Point, Point]]) -> List[Route]:
-        candidate_routes = [
-            self.router.find_route(p1, p2) for p1, p2 in candidate_pairs
-        ]
-        candidate_routes = [
-            r for r in candidate_routes if r.length is not None
+    def select_best_route(self, route_lengths: np.ndarray,
+                          target_length: float) -> int:
+        """Return the index of the route length closest to target_length."""
+        best_route_idx = np.argmin(np.abs(route_lengths - target_length))
+        return int(best_route_idx)
+
+    def get_candidate_paths(
+            self, candidate_pairs: Iterable[Tuple[Point, Point]]
+    ) -> Tuple[List[List[Any]], np.ndarray]:
+        """Find paths between candidate pairs, skipping pairs with no path.
+
+        Returns the node ids of each path and an array of their lengths;
+        no geometry is built.
+        """
+        candidate_paths = [
+            self.router.find_path(p1, p2) for p1, p2 in candidate_pairs
         ]
-        return candidate_routes
+        candidate_paths = [(path, length) for path, length in candidate_paths
+                           if path is not None]
+        paths = [path for path, _ in candidate_paths]
+        route_lengths = np.array([length for _, length in candidate_paths])
+        return paths, route_lengths
 
     def get_candidate_pairs(self,
                             p1_candidates: Iterable[Point],
@@ -90,7 +154,51 @@ class Matcher():
         return filtered_pairs, filtered_diffs
 
 
+def match_inventory(matcher: Matcher, df: 'pd.DataFrame') -> List[Route]:
+    from tqdm import tqdm
+
+    routes = []
+    nmatches = 0
+    iter_cols = [*ENDPOINT_COLS, PROCESSED_LENGTH_COL]
+    it = df[iter_cols].itertuples(index=False, name=None)
+    with tqdm(it, total=len(df)) as bar:
+        for p1, p2, tgt_length in bar:
+            route = matcher.match(p1, p2, tgt_length)
+            routes.append(route)
+            if route.length is not None:
+                nmatches += 1
+                bar.set_postfix({
+                    'start': p1,
+                    'end': p2,
+                    'diff': tgt_length - route.length,
+                    'matches': nmatches
+                })
+    return routes
+
+
+def save_matches(df: 'pd.DataFrame', routes: List[Route], out_dir: str,
+                 name: str) -> None:
+    import pickle
+    import geopandas as gpd
+
+    df['geometry'] = [r.geom for r in routes]
+    df['route_length'] = [r.length for r in routes]
+    gdf = gpd.GeoDataFrame(df)
+
+    os.makedirs(out_dir, exist_ok=True)
+    gdf.to_csv(f'{out_dir}/{name}.csv')
+    gdf.to_file(f'{out_dir}/{name}.geojson', driver='GeoJSON')
+
+    with open(f'{out_dir}/gdf.pkl', 'wb') as f:
+        pickle.dump(gdf, f)
+
+
 def main():
+    import pandas as pd
+    from rai.geocode import GeoPyGeocoder
+    from rai.route import Router
+    from rai.preprocess import get_country_preprocesor
+
     # country = 'guatemala'
     # country_code = 'GT'
     # csv_path = '/home/adeel/2021 - RAI Toolkit-20210528T125906Z-001/2021 - RAI Toolkit/' 'Country Data/Guatemala_4-19-2021/Inventario Rutas PDV 2018-2032.csv'  # noqa
@@ -115,35 +223,9 @@ def main():
         query_args={'country': country_code})
     with gcm as geocoder:
         matcher = Matcher(geocoder, router)
-        routes = []
-        nmatches = 0
-        iter_cols = [*ENDPOINT_COLS, PROCESSED_LENGTH_COL]
-        it = df[iter_cols].itertuples(index=False, name=None)
-        with tqdm(it, total=len(df)) as bar:
-            for p1, p2, tgt_length in bar:
-                route = matcher.match(p1, p2, tgt_length)
-                routes.append(route)
-                if route.length is not None:
-                    nmatches += 1
-                    bar.set_postfix({
-                        'start': p1,
-                        'end': p2,
-                        'diff': tgt_length - route.length,
-                        'matches': nmatches
-                    })
-    df['geometry'] = [r.geom for r in routes]
-    df['route_length'] = [r.length for r in routes]
-    gdf = gpd.GeoDataFrame(df)
-
-    out_dir = f'out/{country}'
-
-    os.makedirs(out_dir, exist_ok=True)
-    gdf.to_csv(f'{out_dir}/{country}.csv')
-    gdf.to_file(f'{out_dir}/{country}.geojson', driver='GeoJSON')
+        routes = match_inventory(matcher, df)
 
-    import pickle
-    with open(f'{out_dir}/gdf.pkl', 'wb') as f:
-        pickle.dump(gdf, f)
+    save_matches(df, routes, f'out/{country}', country)
 
 
 if __name__ == '__main__':
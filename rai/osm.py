@@ -0,0 +1,260 @@
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+import sys
+import time
+import resource
+import logging
+from collections import defaultdict
+
+import numpy as np
+import networkx as nx
+from shapely.geometry import LineString
+import osmium
+
+from rai.utils import GEOD
+
+ONEWAY_VALUES = {'yes', 'true', '1'}
+REVERSE_ONEWAY_VALUES = {'-1', 'reverse'}
+
+logging.basicConfig(
+    stream=sys.stdout,
+    level=logging.INFO,
+    format='%(levelname)s: %(name)s: %(message)s')
+log = logging.getLogger()
+
+
+class WayReader(osmium.SimpleHandler):
+    """Collects the node refs and routing tags of ways whose highway tag is
+    one of highway_types. Only ways are read from the file."""
+
+    def __init__(self, highway_types: Iterable[str]) -> None:
+        super().__init__()
+        self.highway_types = set(highway_types)
+        # (osmid, highway, oneway, node refs in the direction of travel)
+        self.ways: List[Tuple[int, str, bool, np.ndarray]] = []
+
+    def way(self, w: osmium.osm.Way) -> None:
+        highway = w.tags.get('highway')
+        if highway not in self.highway_types or len(w.nodes) < 2:
+            return
+        refs = np.array([n.ref for n in w.nodes], dtype=np.int64)
+        direction = oneway_direction(w.tags)
+        if direction < 0:
+            refs = refs[::-1].copy()
+        self.ways.append((w.id, highway, direction != 0, refs))
+
+
+class NodeReader(osmium.SimpleHandler):
+    """Collects the locations of the nodes in node_ids. Only nodes are read
+    from the file."""
+
+    def __init__(self, node_ids: set) -> None:
+        super().__init__()
+        self.node_ids = node_ids
+        self.ids = []
+        self.lons = []
+        self.lats = []
+
+    def node(self, n: osmium.osm.Node) -> None:
+        if n.id in self.node_ids and n.location.valid():
+            self.ids.append(n.id)
+            self.lons.append(n.location.lon)
+            self.lats.append(n.location.lat)
+
+
+def oneway_direction(tags: osmium.osm.TagList) -> int:
+    """Return 1 for ways that can only be travelled in the direction of their
+    nodes, -1 for ways that can only be travelled against it, else 0."""
+    oneway = tags.get('oneway', '').lower()
+    if oneway in ONEWAY_VALUES:
+        return 1
+    if oneway in REVERSE_ONEWAY_VALUES:
+        return -1
+    if oneway == '' and (tags.get('highway') == 'motorway'
+                         or tags.get('junction') == 'roundabout'):
+        return 1
+    return 0
+
+
+def graph_from_pbf(pbf_path: str,
+                   highway_types: Iterable[str],
+                   simplify: bool = True) -> nx.MultiDiGraph:
+    """Build a routing graph from a local .osm.pbf extract.
+
+    The file is streamed twice: once for the ways with the given highway
+    tags and once for the locations of their nodes, so that nothing else in
+    the extract is held in memory.
+
+    If simplify is True, ways that meet end to end at a node no other way
+    uses, and that have the same highway and oneway tags, are first joined
+    into a single chain. Only chain endpoints and nodes shared between
+    chains then become graph nodes, and the shape points in between are
+    kept as each edge's geometry, as ox.simplify_graph does. Unlike
+    ox.simplify_graph, ways with different highway or oneway tags are never
+    contracted into one edge.
+    """
+    t_start = time.perf_counter()
+
+    log.info('Reading ways from PBF ...')
+    way_reader = WayReader(highway_types)
+    way_reader.apply_file(pbf_path)
+    ways = way_reader.ways
+    del way_reader
+    if len(ways) == 0:
+        raise ValueError(f'No ways with highway in {highway_types} found in '
+                         f'{pbf_path}.')
+
+    all_refs = np.concatenate([refs for *_, refs in ways])
+    node_ids, ref_counts = np.unique(all_refs, return_counts=True)
+    del all_refs
+
+    log.info('Reading node locations from PBF ...')
+    node_reader = NodeReader(set(node_ids.tolist()))
+    node_reader.apply_file(pbf_path)
+    ids = np.array(node_reader.ids, dtype=np.int64)
+    order = np.argsort(ids)
+    ids = ids[order]
+    lons = np.array(node_reader.lons)[order]
+    lats = np.array(node_reader.lats)[order]
+    del node_reader
+    if len(ids) == 0:
+        raise ValueError(f'No node locations found in {pbf_path}.')
+
+    # nodes referenced more than once are shared between (or within) ways
+    shared_ids = set(node_ids[ref_counts > 1].tolist())
+    if simplify:
+        ways, joints = merge_ways(ways, node_ids, ref_counts)
+        shared_ids -= joints
+    del node_ids, ref_counts
+
+    log.info('Building graph ...')
+    G = nx.MultiDiGraph(crs='epsg:4326', simplified=simplify)
+    for osmid, highway, oneway, refs in ways:
+        inds = np.searchsorted(ids, refs).clip(max=len(ids) - 1)
+        # drop nodes missing from the extract
+        found = ids[inds] == refs
+        refs, inds = refs[found], inds[found]
+        if len(refs) < 2:
+            continue
+        xs, ys = lons[inds], lats[inds]
+        _, _, seg_lengths = GEOD.inv(xs[:-1], ys[:-1], xs[1:], ys[1:])
+        cum_lengths = np.concatenate(([0.], np.cumsum(seg_lengths)))
+
+        if simplify:
+            is_node = np.array([r in shared_ids for r in refs.tolist()])
+            is_node[[0, -1]] = True
+            node_inds = np.flatnonzero(is_node)
+        else:
+            node_inds = np.arange(len(refs))
+
+        for i in node_inds:
+            G.add_node(int(refs[i]), x=float(xs[i]), y=float(ys[i]))
+
+        attrs = {'osmid': osmid, 'highway': highway, 'oneway': oneway}
+        for i, j in zip(node_inds, node_inds[1:]):
+            u, v = int(refs[i]), int(refs[j])
+            length = float(cum_lengths[j] - cum_lengths[i])
+            geom = None
+            if j - i > 1:
+                geom = LineString(np.column_stack((xs[i:j + 1], ys[i:j + 1])))
+            add_way_edge(G, u, v, length, geom, attrs)
+            if not oneway:
+                rev_geom = None if geom is None else LineString(
+                    geom.coords[::-1])
+                add_way_edge(G, v, u, length, rev_geom, attrs)
+
+    build_time = time.perf_counter() - t_start
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    log.info(f'Built graph with {len(G.nodes)} nodes and {len(G.edges)} '
+             f'edges in {build_time:.1f}s (peak RSS: {peak_rss:.0f} MB).')
+    return G
+
+
+def merge_ways(ways: List[Tuple[int, str, bool, np.ndarray]],
+               node_ids: np.ndarray, ref_counts: np.ndarray
+               ) -> Tuple[List[Tuple[Any, str, bool, np.ndarray]], Set[int]]:
+    """Join ways end to end into chains wherever two ways with the same
+    highway and oneway tags meet at a node that no other way references.
+
+    Returns the chains, with the osmid of each chain being a list if it
+    joins more than one way, and the set of nodes the ways were joined at.
+    """
+    # endpoint node -> [(way index, whether it is the way's first node)]
+    ends: Dict[int, List[Tuple[int, bool]]] = defaultdict(list)
+    for i, (*_, refs) in enumerate(ways):
+        ends[int(refs[0])].append((i, True))
+        ends[int(refs[-1])].append((i, False))
+    end_ids = np.array(list(ends), dtype=np.int64)
+    end_counts = ref_counts[np.searchsorted(node_ids, end_ids)]
+    ref_count = dict(zip(end_ids.tolist(), end_counts.tolist()))
+
+    def joinable(i: int, node: int) -> Optional[Tuple[int, bool]]:
+        # the node must be an endpoint of exactly two different ways and
+        # referenced nowhere else
+        if ref_count[node] != 2 or len(ends[node]) != 2:
+            return None
+        (a, a_first), (b, b_first) = ends[node]
+        if a == b:
+            return None
+        (j, j_first), i_first = ((b, b_first), a_first) if a == i else (
+            (a, a_first), b_first)
+        _, highway_i, oneway_i, _ = ways[i]
+        _, highway_j, oneway_j, _ = ways[j]
+        if highway_i != highway_j or oneway_i != oneway_j:
+            return None
+        # oneway ways can only be joined head to tail
+        if oneway_i and i_first == j_first:
+            return None
+        return j, j_first
+
+    used = np.zeros(len(ways), dtype=bool)
+    joints = set()
+    chains = []
+    for i, (osmid, highway, oneway, refs) in enumerate(ways):
+        if used[i]:
+            continue
+        used[i] = True
+
+        # extend the chain forward from its last node ...
+        tail_ids, tail = [], []
+        cur, node = i, int(refs[-1])
+        while True:
+            joined = joinable(cur, node)
+            if joined is None or used[joined[0]]:
+                break
+            j, j_first = joined
+            used[j] = True
+            joints.add(node)
+            j_refs = ways[j][3] if j_first else ways[j][3][::-1]
+            tail_ids.append(ways[j][0])
+            tail.append(j_refs[1:])
+            cur, node = j, int(j_refs[-1])
+
+        # ... and backward from its first node
+        head_ids, head = [], []
+        cur, node = i, int(refs[0])
+        while True:
+            joined = joinable(cur, node)
+            if joined is None or used[joined[0]]:
+                break
+            j, j_first = joined
+            used[j] = True
+            joints.add(node)
+            j_refs = ways[j][3][::-1] if j_first else ways[j][3]
+            head_ids.append(ways[j][0])
+            head.append(j_refs[:-1])
+            cur, node = j, int(j_refs[0])
+
+        osmids = head_ids[::-1] + [osmid] + tail_ids
+        chain_refs = np.concatenate(head[::-1] + [refs] + tail)
+        chains.append((osmids if len(osmids) > 1 else osmid, highway, oneway,
+                       chain_refs))
+    return chains, joints
+
+
+def add_way_edge(G: nx.MultiDiGraph, u: int, v: int, length: float,
+                 geom: Optional[LineString], attrs: dict) -> None:
+    if geom is None:
+        G.add_edge(u, v, length=length, **attrs)
+    else:
+        G.add_edge(u, v, length=length, geometry=geom, **attrs)
@@ -1,18 +1,32 @@
-# flake8: noqa
+from importlib import import_module
+from typing import TYPE_CHECKING, Any, Type
 
-from rai.preprocess.preprocessor import *
-from rai.preprocess.guatemala import *
-from rai.preprocess.paraguay import *
+if TYPE_CHECKING:
+    from rai.preprocess.preprocessor import Preprocessor
+
+# preprocessors (and pandas) are only imported when first accessed, so that
+# importing a single submodule does not load every country's preprocessor
+preprocessor_modules = {
+    'Preprocessor': 'rai.preprocess.preprocessor',
+    'GuatemalaPreprocessor': 'rai.preprocess.guatemala',
+    'ParaguayPreprocessor': 'rai.preprocess.paraguay',
+}
 
 country_to_preprocessor = {
-    'guatemala': GuatemalaPreprocessor,
-    'gt': GuatemalaPreprocessor,
-    'paraguay': ParaguayPreprocessor,
-    'py': ParaguayPreprocessor
+    'guatemala': 'GuatemalaPreprocessor',
+    'gt': 'GuatemalaPreprocessor',
+    'paraguay': 'ParaguayPreprocessor',
+    'py': 'ParaguayPreprocessor'
 }
 
 
-def get_country_preprocesor(country: str) -> Preprocessor:
+def __getattr__(name: str) -> Any:
+    if name in preprocessor_modules:
+        return getattr(import_module(preprocessor_modules[name]), name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def get_country_preprocesor(country: str) -> Type['Preprocessor']:
     country = country.strip().lower()
-    preprocessor = country_to_preprocessor[country]
+    preprocessor = __getattr__(country_to_preprocessor[country])
     return preprocessor
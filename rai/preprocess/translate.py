@@ -1,7 +1,14 @@
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple
 import sys
+import os
+import pickle
 import logging
+from contextlib import AbstractContextManager
 
-from argostranslate import package, translate
+if TYPE_CHECKING:
+    from argostranslate import translate as argos_translate
+
+CACHE_PATH = 'translator.cache'
 
 logging.basicConfig(
     stream=sys.stdout,
@@ -10,40 +17,110 @@ logging.basicConfig(
 log = logging.getLogger()
 
 
-class Translator():
-    def __init__(self, from_code: str, to_code: str) -> None:
-        self.populate_packages()
-        self.model = self.load_model(from_code, to_code)
+class Translator(AbstractContextManager):
+    """Translates strings with an argostranslate model.
+
+    The model is loaded on first use, installing its package only if it is
+    not installed already. Translations are memoized per language pair and,
+    when used as a context manager, persisted to cache_path.
+    """
+
+    def __init__(self,
+                 from_code: str,
+                 to_code: str,
+                 cache_path: os.PathLike = CACHE_PATH) -> None:
+        self.from_code = from_code
+        self.to_code = to_code
+        self.cache_path = cache_path
+        # (from_code, to_code) -> {string: translation}
+        self.cache: Dict[Tuple[str, str], Dict[str, str]] = {}
+        self._model = None
+
+    def __enter__(self) -> 'Translator':
+        self.load_cache_from_file(self.cache_path)
+        return self
+
+    def __exit__(self, *args, **kwargs) -> Optional[bool]:
+        return self.save_cache_to_file(self.cache_path)
+
+    def load_cache_from_file(self, cache_path: os.PathLike):
+        if os.path.exists(cache_path):
+            log.info('Loading cache from file ...')
+            with open(cache_path, 'rb') as f:
+                self.cache = pickle.load(f)
+
+    def save_cache_to_file(self, cache_path: os.PathLike):
+        log.info('Saving cache to file ...')
+        with open(cache_path, 'wb') as f:
+            pickle.dump(self.cache, f)
+
+    @property
+    def pair_cache(self) -> Dict[str, str]:
+        return self.cache.setdefault((self.from_code, self.to_code), {})
+
+    @property
+    def model(self) -> 'argos_translate.ITranslation':
+        if self._model is None:
+            self._model = self.load_model(self.from_code, self.to_code)
+        return self._model
 
     def translate(self, s: str) -> str:
-        return self.model.translate(s)
+        cache = self.pair_cache
+        if s not in cache:
+            cache[s] = self.model.translate(s)
+        return cache[s]
 
     def __call__(self, s: str) -> str:
         return self.translate(s)
 
-    def populate_packages(self):
-        package.update_package_index()
-        self.installed_packages = {(p.from_code, p.to_code): p
-                                   for p in package.get_installed_packages()}
-        self.available_packages = {(p.from_code, p.to_code): p
-                                   for p in package.get_available_packages()}
+    def translate_many(self, strings: Iterable[Any]) -> List[Any]:
+        """Translate strings, running each distinct string that is not
+        already cached through the model once. Values that are not strings
+        (e.g. NaN) are returned unchanged."""
+        strings = list(strings)
+        cache = self.pair_cache
+        todo = list(
+            dict.fromkeys(
+                s for s in strings if isinstance(s, str) and s not in cache))
+
+        if len(todo) > 0:
+            log.info(f'Translating {len(todo)} unique strings ...')
+            for s in todo:
+                cache[s] = self.model.translate(s)
+
+        return [cache[s] if isinstance(s, str) else s for s in strings]
 
     def load_model(self, from_code: str,
-                   to_code: str) -> translate.CachedTranslation:
+                   to_code: str) -> 'argos_translate.ITranslation':
+        from argostranslate import translate as argos_translate
+
         self.install_package_if_needed(from_code, to_code)
-        langs = {l.code: l for l in translate.get_installed_languages()}
+        langs = {
+            l.code: l
+            for l in argos_translate.get_installed_languages()
+        }
         model = langs[from_code].get_translation(langs[to_code])
         return model
 
     def install_package_if_needed(self, from_code: str, to_code: str) -> None:
+        from argostranslate import package
+
         k = (from_code, to_code)
+        self.installed_packages = {(p.from_code, p.to_code): p
+                                   for p in package.get_installed_packages()}
         if k in self.installed_packages:
             log.info('Loading already installed model.')
-        elif k in self.available_packages:
-            log.info('Downloading package ...')
-            pkg = self.packages[k]
-            model_path = pkg.download()
-            log.info('Installing package ...')
-            package.install_from_path(model_path)
-        else:
+            return
+
+        # only go online if the package is not installed
+        log.info('Updating package index ...')
+        package.update_package_index()
+        self.available_packages = {(p.from_code, p.to_code): p
+                                   for p in package.get_available_packages()}
+        if k not in self.available_packages:
             raise KeyError(f'({k}) not found in available packages.')
+        log.info('Downloading package ...')
+        pkg = self.available_packages[k]
+        model_path = pkg.download()
+        log.info('Installing package ...')
+        package.install_from_path(model_path)
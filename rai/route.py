@@ -1,17 +1,19 @@
-from typing import Any, Optional, List
+from typing import TYPE_CHECKING, Any, Dict, Optional, List, Tuple
 import sys
 import os
 import logging
+from heapq import heappush, heappop
+from itertools import count
 
+import numpy as np
 from shapely.geometry import Point, LineString
 
-import osmnx as ox
-import networkx as nx
-from networkx.classes.function import path_weight
-
 from rai.utils import geographical_distance
 
-ox.config(use_cache=True, log_console=False)
+# osmnx and networkx are slow to import, so they are only imported once a
+# Router is actually used
+if TYPE_CHECKING:
+    import networkx as nx
 
 logging.basicConfig(
     stream=sys.stdout,
@@ -21,43 +23,140 @@ log = logging.getLogger()
 
 
 class Route():
-    def __init__(self, points: List[Point], length: float) -> None:
-        self.points = points
+    """A route through the road graph. The shapely points and geometry are
+    only built from the coordinate array when first accessed."""
+    __slots__ = ('nodes', 'coords', 'length', '_points', '_geom')
+
+    def __init__(self, nodes: List[Any], coords: np.ndarray,
+                 length: Optional[float]) -> None:
+        self.nodes = nodes
+        self.coords = coords
         self.length = length
-        self.geom = LineString(points) if len(points) > 0 else None
+        self._points = None
+        self._geom = None
+
+    @property
+    def points(self) -> List[Point]:
+        if self._points is None:
+            self._points = [Point(x, y) for x, y in self.coords]
+        return self._points
+
+    @property
+    def geom(self) -> Optional[LineString]:
+        if self._geom is None and len(self.coords) > 1:
+            self._geom = LineString(self.coords)
+        return self._geom
 
     @classmethod
     def null(cls):
-        return Route([], None)
+        return Route([], np.empty((0, 2)), None)
 
 
 class Router():
-    def __init__(self, region: str) -> None:
+    def __init__(self,
+                 region: str,
+                 simplify: bool = True,
+                 pbf_path: Optional[os.PathLike] = None) -> None:
+        import osmnx as ox
+        ox.config(use_cache=True, log_console=False)
+
         self.region = region
+        self.simplify = simplify
+        self.pbf_path = pbf_path
         self.G = self.get_graph(region, save=True)
+        if simplify:
+            self.pack_edge_geometries(self.G)
         self.nodes = self.G.nodes
+        # built on first use by nearest_nodes
+        self.node_index = None
+        # optional {(x, y): node} lookup of points snapped in advance
+        self.snapped = None
+
+    def get_graph(self, region: str, save: bool = True) -> 'nx.Graph':
+        import osmnx as ox
 
-    def get_graph(self, region: str, save: bool = True) -> nx.Graph:
         if os.path.exists(self.get_save_path(region)):
             log.info('Loading graph from file ...')
             G = ox.load_graphml(self.get_save_path(region))
+        elif self.pbf_path is not None:
+            # imported here so that osmium is only needed for PBF ingestion
+            from rai.osm import graph_from_pbf
+            log.info('Building graph from PBF ...')
+            G = graph_from_pbf(
+                self.pbf_path, get_highway_types(), simplify=self.simplify)
+            if save:
+                log.info('Saving graph ...')
+                self.save_graph(G, self.get_save_path(region))
         else:
             log.info('Downloading graph ...')
-            G = download_road_graph(region)
+            G = download_road_graph(region, simplify=self.simplify)
             if save:
                 log.info('Saving graph ...')
                 self.save_graph(G, self.get_save_path(region))
         return G
 
     def get_save_path(self, region: str) -> os.PathLike:
-        return f'graphs/{region}.graphml'
+        # graphs built from PBF extracts and downloaded from Overpass differ,
+        # so they are cached separately
+        source = '.pbf' if self.pbf_path is not None else ''
+        simplified = '.simplified' if self.simplify else ''
+        return f'graphs/{region}{source}{simplified}.graphml'
+
+    def pack_edge_geometries(self, G: 'nx.Graph') -> None:
+        """Replace the shapely geometries that simplification attaches to
+        contracted edges with (n, 2) coordinate arrays.
+
+        Edges without a geometry are straight segments between their end
+        nodes and are left as they are. The packed graph can no longer be
+        written with save_graph.
+        """
+        for _, _, data in G.edges(data=True):
+            geom = data.pop('geometry', None)
+            if geom is not None:
+                data['coords'] = np.asarray(geom.coords, dtype=float)
 
     def save_graph(self, G, save_path: Optional[os.PathLike] = None) -> None:
+        import osmnx as ox
+
         if save_path is None:
             save_path = self.get_save_path(self.region)
         os.makedirs(os.path.dirname(os.path.abspath(save_path)), exist_ok=True)
         ox.save_graphml(G, save_path)
 
+    def build_node_index(self) -> Tuple[Any, List[Any]]:
+        from sklearn.neighbors import BallTree
+
+        keys = list(self.nodes)
+        lat_lons = np.array([[self.nodes[k]['y'], self.nodes[k]['x']]
+                             for k in keys])
+        tree = BallTree(np.deg2rad(lat_lons), metric='haversine')
+        return tree, keys
+
+    def nearest_nodes(self, points: List[Point]) -> List[Any]:
+        """Return the node nearest to each point, with a single query of a
+        spatial index that, unlike in ox.distance.nearest_nodes, is only
+        built once per Router."""
+        if self.node_index is None:
+            self.node_index = self.build_node_index()
+        tree, keys = self.node_index
+        lat_lons = [[y, x] for x, y in (p.coords[0] for p in points)]
+        _, inds = tree.query(np.deg2rad(lat_lons), k=1)
+        return [keys[i] for i in inds[:, 0]]
+
+    def nearest_node(self, p: Point) -> Any:
+        if self.snapped is not None and p.coords[0] in self.snapped:
+            return self.snapped[p.coords[0]]
+        return self.nearest_nodes([p])[0]
+
+    def snap(self, points: List[Point]) -> Dict[Tuple[float, float], Any]:
+        """Snap points to their nearest nodes in one query, returning a
+        lookup that can be assigned to self.snapped."""
+        coords = list(dict.fromkeys(p.coords[0] for p in points))
+        if len(coords) == 0:
+            return {}
+        nodes = self.nearest_nodes([Point(xy) for xy in coords])
+        return dict(zip(coords, nodes))
+
     def heuristic(self, node1: Any, node2: Any) -> float:
         p1, p2 = self.node_to_point(node1), self.node_to_point(node2)
         return geographical_distance(p1, p2)
@@ -72,35 +171,147 @@ class Router():
         return points
 
     def route_to_geom(self, route: list) -> LineString:
-        points = [self.node_to_point(node) for node in route]
-        geom = LineString(points)
+        geom = LineString(self.path_to_coords(route))
         return geom
 
-    def find_route(self, p1: Point, p2: Point, km: bool = True) -> Route:
+    def edge_coords(self, u: Any, v: Any) -> np.ndarray:
+        edges = self.G[u][v]
+        data = min(edges.values(), key=lambda d: d.get('length', 1))
+        coords = data.get('coords')
+        nu, nv = self.nodes[u], self.nodes[v]
+        xy_u, xy_v = [nu['x'], nu['y']], [nv['x'], nv['y']]
+        if coords is None:
+            return np.array([xy_u, xy_v])
+        # make sure the geometry runs from u to v
+        if np.abs(coords[0] - xy_u).sum() > np.abs(coords[0] - xy_v).sum():
+            coords = coords[::-1]
+        return coords
+
+    def path_to_coords(self, path: List[Any]) -> np.ndarray:
+        """Expand a path over the (possibly simplified) graph to the full
+        resolution coordinates of the roads it follows."""
+        if len(path) == 1:
+            node = self.nodes[path[0]]
+            return np.array([[node['x'], node['y']]])
+        segments = [self.edge_coords(u, v) for u, v in zip(path, path[1:])]
+        # consecutive segments share their end/start points
+        segments = segments[:1] + [seg[1:] for seg in segments[1:]]
+        return np.concatenate(segments)
+
+    def find_route(self,
+                   p1: Point,
+                   p2: Point,
+                   km: bool = True,
+                   max_length: Optional[float] = None) -> Route:
+        path, route_length = self.find_path(
+            p1, p2, km=km, max_length=max_length)
+        if path is None:
+            return Route.null()
+        return self.path_to_route(path, route_length)
+
+    def path_to_route(self, path: List[Any], length: float) -> Route:
+        return Route(path, self.path_to_coords(path), length)
+
+    def find_path(self,
+                  p1: Point,
+                  p2: Point,
+                  km: bool = True,
+                  max_length: Optional[float] = None
+                  ) -> Tuple[Optional[List[Any]], Optional[float]]:
+        """Find the shortest path between the nodes nearest to p1 and p2.
+
+        Only the node ids and the path length are returned so that callers
+        comparing several candidates can defer building geometry. If
+        max_length is given (in km if km=True, else in meters), the search
+        is abandoned as soon as no path within that length can exist.
+        """
+        import networkx as nx
+        from networkx.classes.function import path_weight
+
         G = self.G
-        start = p1.coords[0]
-        end = p2.coords[0]
-        start_node = ox.distance.nearest_nodes(G, *start)
-        end_node = ox.distance.nearest_nodes(G, *end)
-
-        try:
-            path = nx.shortest_paths.astar_path(
-                G,
-                start_node,
-                end_node,
-                weight='length',
-                heuristic=self.heuristic)
+        start_node = self.nearest_node(p1)
+        end_node = self.nearest_node(p2)
+
+        if max_length is None:
+            try:
+                path = nx.shortest_paths.astar_path(
+                    G,
+                    start_node,
+                    end_node,
+                    weight='length',
+                    heuristic=self.heuristic)
+            except nx.NetworkXNoPath:
+                return None, None
             route_length = path_weight(G, path, weight='length')
+        else:
             if km:
-                route_length /= 1e3
-            route = Route(self.nodes_to_points(path), route_length)
-        except nx.NetworkXNoPath:
-            route = Route.null()
+                max_length = max_length * 1e3
+            path, route_length = self.bounded_astar_path(
+                start_node, end_node, max_length)
+            if path is None:
+                return None, None
+
+        if km:
+            route_length /= 1e3
+        return path, route_length
+
+    def bounded_astar_path(self, source: Any, target: Any, max_length: float
+                           ) -> Tuple[Optional[List[Any]], Optional[float]]:
+        """A* search over edge lengths (in meters) that gives up once the
+        lower bound (distance so far + straight-line distance to the target)
+        of every frontier node exceeds max_length.
+        """
+        G = self.G
+        if source == target:
+            return [source], 0.
+
+        # the counter breaks ties so that nodes themselves are never compared
+        c = count()
+        queue = [(self.heuristic(source, target), next(c), source, 0., None)]
+        # node -> (distance, heuristic) for nodes that have been queued
+        enqueued = {}
+        explored = {}
+
+        while queue:
+            _, _, curnode, dist, parent = heappop(queue)
+
+            if curnode == target:
+                path = [curnode]
+                node = parent
+                while node is not None:
+                    path.append(node)
+                    node = explored[node]
+                path.reverse()
+                return path, dist
+
+            if curnode in explored:
+                # a shorter path to this node has already been expanded
+                if explored[curnode] is None:
+                    continue
+                qcost, _ = enqueued[curnode]
+                if qcost < dist:
+                    continue
 
-        return route
+            explored[curnode] = parent
 
+            for neighbor, edges in G[curnode].items():
+                cost = min(d.get('length', 1) for d in edges.values())
+                ncost = dist + cost
+                if neighbor in enqueued:
+                    qcost, h = enqueued[neighbor]
+                    if qcost <= ncost:
+                        continue
+                else:
+                    h = self.heuristic(neighbor, target)
+                if ncost + h > max_length:
+                    continue
+                enqueued[neighbor] = ncost, h
+                heappush(queue, (ncost + h, next(c), neighbor, ncost, curnode))
 
-def download_road_graph(region: str, **kwargs) -> nx.Graph:
+        return None, None
+
+
+def get_highway_types(**kwargs) -> List[str]:
     highway_types_to_inlcude = []
     if kwargs.get('trunk', True):
         highway_types_to_inlcude.append('trunk')
@@ -120,14 +331,21 @@ def download_road_graph(region: str, **kwargs) -> nx.Graph:
     if kwargs.get('residential', False):
         highway_types_to_inlcude.append('residential')
         highway_types_to_inlcude.append('residential_link')
+    return highway_types_to_inlcude
+
+
+def download_road_graph(region: str,
+                        simplify: bool = False,
+                        **kwargs) -> 'nx.Graph':
+    import osmnx as ox
 
-    highway_types_to_inlcude = '|'.join(highway_types_to_inlcude)
+    highway_types_to_inlcude = '|'.join(get_highway_types(**kwargs))
     custom_filter = f'["highway"~"{highway_types_to_inlcude}"]'
 
     G = ox.graph_from_place(
         region,
         network_type='drive',
         custom_filter=custom_filter,
-        simplify=False)
+        simplify=simplify)
 
     return G
@@ -0,0 +1,487 @@
+"""A long-lived matching service that keeps region routers and geocoders
+warm between requests.
+
+Requests are JSON objects like
+
+    {"id": 1, "region": "paraguay", "start": "VILLETA", "end": "ALBERDI",
+     "length": 12.5}
+
+read either as JSONL from stdin (responses are written as JSONL to stdout,
+in completion order) or POSTed to /match on a local HTTP server. Requests
+for the same region are micro-batched by a worker thread per region, which
+snaps the candidate points of all endpoints in a batch to the road graph
+with a single spatial index query.
+"""
+from typing import Any, Dict, List, Optional, TextIO
+import sys
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from shapely.geometry import mapping
+
+from rai.match import Matcher
+from rai.route import Route
+
+logging.basicConfig(
+    stream=sys.stdout,
+    level=logging.INFO,
+    format='%(levelname)s: %(name)s: %(message)s')
+log = logging.getLogger()
+
+
+class MatchRequest():
+    def __init__(self, request: Dict[str, Any]) -> None:
+        self.id = request.get('id')
+        self.region = request['region']
+        self.start = request['start']
+        self.end = request['end']
+        for k in ('region', 'start', 'end'):
+            if not isinstance(request[k], str):
+                raise TypeError(f'{k} must be a string, not '
+                                f'{type(request[k]).__name__}')
+        self.length = float(request['length'])
+        self.received = time.perf_counter()
+        self.future = Future()
+
+    def response(self, route: Route) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'region': self.region,
+            'route_length': route.length,
+            'geometry': None if route.geom is None else mapping(route.geom),
+            'latency_ms': self.latency_ms()
+        }
+
+    def error_response(self, e: Exception) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'region': self.region,
+            'error': f'{type(e).__name__}: {e}',
+            'latency_ms': self.latency_ms()
+        }
+
+    def latency_ms(self) -> float:
+        return round((time.perf_counter() - self.received) * 1e3, 1)
+
+
+class Region():
+    """A warm Router and Geocoder for one region, plus the worker thread
+    that matches batches of requests against them."""
+
+    # per-element memory costs in bytes, measured as the growth in RSS
+    # while building each structure 100k-400k elements at a time and
+    # rounded up. Graph nodes carry x, y and street_count and edges osmid,
+    # highway, oneway, length, name and lanes (~580 and ~770); edges with
+    # more tags cost more.
+    NODE_BYTES = 600
+    EDGE_BYTES = 800
+    # a shapely 2 Point in a gazetteer (~300), and a place name with its
+    # list of Points (~100)
+    POINT_BYTES = 300
+    PLACE_BYTES = 100
+    # a cached geocoder query with five names and Points (~1550)
+    CACHE_ENTRY_BYTES = 1600
+
+    def __init__(self,
+                 name: str,
+                 config: Dict[str, Any],
+                 batch_size: int = 32,
+                 batch_wait: float = 0.01) -> None:
+        from rai.geocode import make_geocoder
+        from rai.route import Router
+
+        self.name = name
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.max_candidate_routes = config.get('max_candidate_routes', 10)
+        self.length_tol = config.get('length_tol', None)
+
+        self.router = Router(
+            config.get('graph_region', name), pbf_path=config.get('pbf'))
+        # build the snapping index now rather than on the first request
+        self.router.node_index = self.router.build_node_index()
+        self.geocoder = make_geocoder(
+            cache_path=config.get('cache', f'{name}.geocoder.cache'),
+            geonames_csv=config.get('geonames_csv'),
+            username=config.get('username'),
+            country_code=config.get('country_code'))
+        self.geocoder.__enter__()
+        self.base_memory = (self.estimate_graph_memory() +
+                            self.estimate_gazetteer_memory())
+
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(
+            target=self.run, name=f'region-{name}', daemon=True)
+        self.worker.start()
+
+    @property
+    def memory(self) -> int:
+        """Estimated memory held by the region in bytes, including the
+        geocoder cache as it grows."""
+        return (self.base_memory +
+                len(self.geocoder.cache) * self.CACHE_ENTRY_BYTES)
+
+    def estimate_graph_memory(self) -> int:
+        """Estimate the memory held by the region's graph and snapping index
+        in bytes."""
+        G = self.router.G
+        coords_bytes = sum(d['coords'].nbytes
+                           for _, _, d in G.edges(data=True) if 'coords' in d)
+        # the index holds each node's coordinates twice and a key list
+        index_bytes = len(G.nodes) * (4 * 8 + 8)
+        return (len(G.nodes) * self.NODE_BYTES + len(G.edges) * self.EDGE_BYTES
+                + coords_bytes + index_bytes)
+
+    def estimate_gazetteer_memory(self) -> int:
+        """Estimate the memory held by the geocoder's gazetteer in bytes, if
+        it geocodes against one (e.g. a CustomGeocoder over GeoNames)."""
+        places_to_geoms = getattr(self.geocoder, 'places_to_geoms', None)
+        if places_to_geoms is None:
+            return 0
+        n_points = sum(len(ps) for ps in places_to_geoms.values())
+        return (len(places_to_geoms) * self.PLACE_BYTES +
+                n_points * self.POINT_BYTES)
+
+    def submit(self, request: MatchRequest) -> None:
+        self.requests.put(request)
+
+    def close(self) -> None:
+        """Stop the worker once the requests already submitted have been
+        matched, then save the geocoder cache."""
+        self.requests.put(None)
+
+    def run(self) -> None:
+        closing = False
+        while not closing:
+            batch = [self.requests.get()]
+            deadline = time.perf_counter() + self.batch_wait
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.perf_counter()
+                try:
+                    batch.append(self.requests.get(timeout=max(timeout, 0)))
+                except queue.Empty:
+                    break
+            if None in batch:
+                closing = True
+                batch = [r for r in batch if r is not None]
+            if len(batch) > 0:
+                self.match_batch(batch)
+        self.geocoder.__exit__(None, None, None)
+        log.info(f'Closed region {self.name}.')
+
+    def match_batch(self, batch: List[MatchRequest]) -> None:
+        # geocode every endpoint name in the batch up front, so that all of
+        # the candidate points can be snapped to the graph in a single query
+        geocoded = {}
+        for q in dict.fromkeys(n for r in batch for n in (r.start, r.end)):
+            try:
+                geocoded[q] = self.geocoder(q)
+            except Exception as e:
+                geocoded[q] = e
+        points = [
+            p for res in geocoded.values() if not isinstance(res, Exception)
+            for p in res[1]
+        ]
+
+        def geocode(q: str):
+            res = geocoded[q]
+            if isinstance(res, Exception):
+                raise res
+            return res
+
+        matcher = Matcher(
+            geocode,
+            self.router,
+            max_candidate_routes=self.max_candidate_routes,
+            length_tol=self.length_tol)
+        routes = {}
+        self.router.snapped = self.router.snap(points)
+        try:
+            for request in batch:
+                k = (request.start, request.end, request.length)
+                try:
+                    if k not in routes:
+                        routes[k] = matcher.match(*k)
+                    response = request.response(routes[k])
+                except Exception as e:
+                    log.exception(f'Failed to match request {request.id}.')
+                    response = request.error_response(e)
+                log.info(f'{self.name}: request {request.id} answered in '
+                         f'{response["latency_ms"]} ms '
+                         f'(batch of {len(batch)}).')
+                request.future.set_result(response)
+        finally:
+            self.router.snapped = None
+
+
+class MatchService():
+    """Routes match requests to warm Regions, loading regions on demand and
+    evicting the least recently used ones when their estimated memory use
+    exceeds memory_cap (in bytes).
+
+    Regions are loaded on background threads, so requests for warm regions
+    are never held up by a cold one.
+    """
+
+    def __init__(self,
+                 region_configs: Dict[str, Dict[str, Any]],
+                 memory_cap: Optional[int] = None,
+                 batch_size: int = 32,
+                 batch_wait: float = 0.01) -> None:
+        self.region_configs = region_configs
+        self.memory_cap = memory_cap
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.regions: 'OrderedDict[str, Region]' = OrderedDict()
+        # region name -> future of the Region being loaded
+        self.loading: Dict[str, 'Future[Region]'] = {}
+        # evicted regions whose workers may still be draining their queues
+        self.closing: List[Region] = []
+        # only guards the dicts above; never held while loading a region
+        self.lock = threading.Lock()
+
+    def submit(self, request: Dict[str, Any]) -> 'Future[Dict[str, Any]]':
+        try:
+            request = MatchRequest(request)
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            future = Future()
+            request_id = request.get('id') if isinstance(request,
+                                                          dict) else None
+            future.set_result({
+                'id': request_id,
+                'error': f'Invalid request: {type(e).__name__}: {e}'
+            })
+            return future
+        self.dispatch(request)
+        return request.future
+
+    def dispatch(self, request: MatchRequest) -> None:
+        try:
+            region_future = self.get_region(request.region)
+        except KeyError as e:
+            request.future.set_result(request.error_response(e))
+            return
+        # runs right away if the region is already loaded
+        region_future.add_done_callback(
+            lambda f: self.submit_to_region(request, f))
+
+    def submit_to_region(self, request: MatchRequest,
+                         region_future: 'Future[Region]') -> None:
+        try:
+            region = region_future.result()
+        except Exception as e:
+            request.future.set_result(request.error_response(e))
+            return
+        with self.lock:
+            loaded = self.regions.get(region.name) is region
+            if loaded:
+                self.regions.move_to_end(region.name)
+                region.submit(request)
+        if not loaded:
+            # the region was evicted in the meantime, so load it again
+            self.dispatch(request)
+
+    def get_region(self, name: str) -> 'Future[Region]':
+        """Return a future of the named Region, starting to load it on a
+        background thread if it is neither loaded nor loading."""
+        with self.lock:
+            if name in self.regions:
+                future = Future()
+                future.set_result(self.regions[name])
+                return future
+            if name in self.loading:
+                return self.loading[name]
+            if name not in self.region_configs:
+                raise KeyError(f'Unknown region: {name}')
+            future = Future()
+            self.loading[name] = future
+        threading.Thread(
+            target=self.load_region,
+            args=(name, future),
+            name=f'load-{name}',
+            daemon=True).start()
+        return future
+
+    def load_region(self, name: str, future: 'Future[Region]') -> None:
+        log.info(f'Loading region {name} ...')
+        try:
+            region = Region(
+                name,
+                self.region_configs[name],
+                batch_size=self.batch_size,
+                batch_wait=self.batch_wait)
+        except Exception as e:
+            log.exception(f'Failed to load region {name}.')
+            with self.lock:
+                del self.loading[name]
+            future.set_exception(e)
+            return
+        log.info(f'Loaded region {name} '
+                 f'(~{region.memory / 2**20:.0f} MB).')
+        with self.lock:
+            del self.loading[name]
+            self.regions[name] = region
+            self.evict()
+        # outside the lock, since callbacks submit requests under it
+        future.set_result(region)
+
+    def evict(self) -> None:
+        """Close least recently used regions while over the memory cap. Must
+        be called with self.lock held."""
+        self.closing = [r for r in self.closing if r.worker.is_alive()]
+        if self.memory_cap is None:
+            return
+        # never evict the most recently used region
+        while (len(self.regions) > 1
+               and self.memory_usage() > self.memory_cap):
+            name, region = self.regions.popitem(last=False)
+            log.info(f'Evicting region {name} ...')
+            region.close()
+            self.closing.append(region)
+
+    def memory_usage(self) -> int:
+        return sum(r.memory for r in self.regions.values())
+
+    def status(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'regions': {
+                    name: {
+                        'memory_mb': round(r.memory / 2**20, 1),
+                        'queued': r.requests.qsize()
+                    }
+                    for name, r in self.regions.items()
+                },
+                'loading': list(self.loading),
+                'memory_cap_mb': None if self.memory_cap is None else round(
+                    self.memory_cap / 2**20, 1)
+            }
+
+    def close(self) -> None:
+        """Close all regions, including evicted ones that are still
+        draining, and wait for their geocoder caches to be saved."""
+        with self.lock:
+            loading = list(self.loading.values())
+        # let regions that are still loading finish, so that they are closed
+        # below rather than left running
+        for future in loading:
+            future.exception()
+        with self.lock:
+            regions = list(self.regions.values())
+            self.regions.clear()
+            closing = self.closing
+            self.closing = []
+        for region in regions:
+            region.close()
+        for region in regions + closing:
+            region.worker.join()
+
+    def serve_jsonl(self, fin: TextIO = sys.stdin,
+                    fout: TextIO = sys.stdout) -> None:
+        """Read requests from fin, one JSON object per line, and write each
+        response to fout as soon as it is ready."""
+        # other modules log to stdout, which is reserved for responses here
+        for handler in logging.getLogger().handlers:
+            if (isinstance(handler, logging.StreamHandler)
+                    and handler.stream is fout):
+                handler.setStream(sys.stderr)
+
+        write_lock = threading.Lock()
+
+        def write(future: Future) -> None:
+            with write_lock:
+                fout.write(json.dumps(future.result()) + '\n')
+                fout.flush()
+
+        futures = []
+        for line in fin:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError as e:
+                future = Future()
+                future.set_result({'error': f'Invalid JSON: {e}'})
+            else:
+                future = self.submit(request)
+            future.add_done_callback(write)
+            futures.append(future)
+        for future in futures:
+            future.result()
+
+    def serve_http(self, host: str = '127.0.0.1', port: int = 8080) -> None:
+        """Serve POST /match, with a request object or a list of them, and
+        GET /status."""
+        server = ThreadingHTTPServer((host, port), make_handler(self))
+        log.info(f'Serving on http://{host}:{port} ...')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+def make_handler(service: MatchService) -> type:
+    class MatchHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path != '/status':
+                self.send_error(404)
+                return
+            self.send_json(200, service.status())
+
+        def do_POST(self) -> None:
+            if self.path != '/match':
+                self.send_error(404)
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                # a negative length would read until the client disconnects
+                if length < 0:
+                    raise ValueError(f'negative length: {length}')
+            except ValueError as e:
+                self.send_json(400, {'error': f'Invalid Content-Length: {e}'})
+                return
+            # JSONDecodeError and UnicodeDecodeError are both ValueErrors
+            try:
+                body = json.loads(self.rfile.read(length))
+            except ValueError as e:
+                self.send_json(400, {'error': f'Invalid JSON: {e}'})
+                return
+            if isinstance(body, list):
+                futures = [service.submit(r) for r in body]
+                self.send_json(200, [f.result() for f in futures])
+            else:
+                self.send_json(200, service.submit(body).result())
+
+        def send_json(self, code: int, body: Any) -> None:
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format: str, *args) -> None:
+            log.debug(format % args)
+
+    return MatchHandler
+
+
+def load_region_configs(path: os.PathLike) -> Dict[str, Dict[str, Any]]:
+    """Read region configs from a JSON file mapping each region name to the
+    arguments used to build its Router and Geocoder, e.g.
+
+        {"paraguay": {"pbf": "paraguay-latest.osm.pbf",
+                      "geonames_csv": "PY/PY.txt", "length_tol": 10}}
+    """
+    with open(path) as f:
+        return json.load(f)
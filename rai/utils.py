@@ -1,16 +1,30 @@
-from typing import Dict, Optional, Union, List, Any
+from typing import TYPE_CHECKING, Dict, Optional, Union, List, Any
 import os
 import unicodedata as ud
 from collections import defaultdict
 
-from pyproj import CRS
 from shapely.geometry import Point, LineString
 
-from tqdm import tqdm
-import pandas as pd
-import geopandas as gpd
+if TYPE_CHECKING:
+    import geopandas as gpd
+    from pyproj import Geod
 
-GEOD = CRS.from_epsg(4326).get_geod()
+_GEOD = None
+
+
+def get_geod() -> 'Geod':
+    # pyproj is imported on first use to keep `import rai.utils` cheap
+    global _GEOD
+    if _GEOD is None:
+        from pyproj import CRS
+        _GEOD = CRS.from_epsg(4326).get_geod()
+    return _GEOD
+
+
+def __getattr__(name: str) -> Any:
+    if name == 'GEOD':
+        return get_geod()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 # https://stackoverflow.com/a/15547803/5908685
@@ -41,13 +55,17 @@ def geographical_distance(p1: Point,
                           epsg: Optional[Union[int, str]] = None) -> float:
     line_string = LineString((p1, p2))
     if epsg is not None:
+        from pyproj import CRS
         dist = CRS.from_epsg(epsg).get_geod().geometry_length(line_string)
     else:
-        dist = GEOD.geometry_length(line_string)
+        dist = get_geod().geometry_length(line_string)
     return dist
 
 
-def read_geonames_csv(path: os.PathLike) -> pd.DataFrame:
+def read_geonames_csv(path: os.PathLike) -> 'gpd.GeoDataFrame':
+    import pandas as pd
+    import geopandas as gpd
+
     column_names = [
         'geonameid', 'name', 'asciiname', 'alternatenames', 'latitude',
         'longitude', 'feature class', 'feature code', 'country code', 'cc2',
@@ -66,7 +84,10 @@ def read_geonames_csv(path: os.PathLike) -> pd.DataFrame:
     return gdf
 
 
-def geonames_to_dict(places_df: gpd.GeoDataFrame) -> Dict[str, List[Point]]:
+def geonames_to_dict(
+        places_df: 'gpd.GeoDataFrame') -> Dict[str, List[Point]]:
+    from tqdm import tqdm
+
     places = places_df.name.to_numpy()
     places_set = set(places)
     places_to_geoms = defaultdict(list)
@@ -1,3 +1,7 @@
 from setuptools import setup, find_packages
 
-setup(name='rai', version='1.0', packages=find_packages())
+setup(
+    name='rai',
+    version='1.0',
+    packages=find_packages(),
+    entry_points={'console_scripts': ['rai = rai.cli:main']})
@@ -0,0 +1,37 @@
+import pytest
+
+
+@pytest.fixture
+def make_router():
+    """Return a function that builds a Router over a two-way graph without
+    loading one from disk."""
+    nx = pytest.importorskip('networkx')
+    pytest.importorskip('numpy')
+    pytest.importorskip('pyproj')
+    pytest.importorskip('sklearn')
+    geometry = pytest.importorskip('shapely.geometry')
+
+    from rai.route import Router
+    from rai.utils import geographical_distance
+
+    Point = geometry.Point
+
+    def make_router(nodes: dict, edges: list) -> Router:
+        G = nx.MultiDiGraph(crs='epsg:4326')
+        for k, (x, y) in nodes.items():
+            G.add_node(k, x=x, y=y)
+        for u, v in edges:
+            length = geographical_distance(Point(*nodes[u]), Point(*nodes[v]))
+            G.add_edge(u, v, length=length)
+            G.add_edge(v, u, length=length)
+        router = Router.__new__(Router)
+        router.region = 'test'
+        router.simplify = True
+        router.pbf_path = None
+        router.G = G
+        router.nodes = G.nodes
+        router.node_index = None
+        router.snapped = None
+        return router
+
+    return make_router
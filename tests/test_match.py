@@ -0,0 +1,44 @@
+import pytest
+
+pytest.importorskip('networkx')
+pytest.importorskip('numpy')
+pytest.importorskip('pyproj')
+pytest.importorskip('sklearn')
+geometry = pytest.importorskip('shapely.geometry')
+
+from rai.match import Matcher  # noqa: E402
+
+Point = geometry.Point
+
+
+def test_bounded_match_agrees_with_unbounded_for_off_network_points(
+        make_router):
+    # the first pair's points are ~30 km apart but are joined by a ~38 km
+    # detour. The second pair's points are ~39 km apart but snap to nodes
+    # ~31 km apart that are joined directly, so it has the better route even
+    # though the geocoded points alone suggest it cannot beat the first.
+    nodes = {
+        'a': (0, 0),
+        'b': (0.27, 0),
+        'c': (0.135, 0.1044),
+        'd': (1.02, 0),
+        'e': (1.30, 0),
+    }
+    router = make_router(nodes, [('a', 'c'), ('c', 'b'), ('d', 'e')])
+    candidates = {
+        'start': [Point(0, 0), Point(1, 0)],
+        'end': [Point(0.27, 0), Point(1.35, 0)],
+    }
+
+    def geocoder(q):
+        return [q] * len(candidates[q]), candidates[q]
+
+    target_length = 30
+    unbounded = Matcher(geocoder, router).match('start', 'end', target_length)
+    bounded = Matcher(
+        geocoder, router, length_tol=10).match('start', 'end', target_length)
+
+    assert unbounded.nodes == ['d', 'e']
+    assert bounded.nodes == unbounded.nodes
+    assert bounded.length == pytest.approx(unbounded.length)
+    assert abs(bounded.length - target_length) < 2
@@ -0,0 +1,90 @@
+import pytest
+
+osmium = pytest.importorskip('osmium')
+pytest.importorskip('networkx')
+pytest.importorskip('numpy')
+pytest.importorskip('pyproj')
+pytest.importorskip('shapely')
+
+from rai.osm import graph_from_pbf  # noqa: E402
+
+NODES = {
+    # a two-way primary road split into ways 10, 11 and 12
+    1: (0.00, 0.0),
+    2: (0.01, 0.0),
+    3: (0.02, 0.0),
+    4: (0.03, 0.0),
+    5: (0.04, 0.0),
+    # a residential way crossing it at node 3
+    30: (0.02, -0.01),
+    31: (0.02, 0.01),
+    # a oneway=yes way followed by a oneway=-1 way drawn backwards
+    50: (0.00, 0.1),
+    51: (0.01, 0.1),
+    52: (0.02, 0.1),
+    53: (0.03, 0.1),
+    54: (0.04, 0.1),
+}
+
+WAYS = [
+    (10, [1, 2], {'highway': 'primary'}),
+    (11, [2, 3, 4], {'highway': 'primary'}),
+    (12, [4, 5], {'highway': 'primary'}),
+    (20, [30, 3, 31], {'highway': 'residential'}),
+    (40, [50, 51, 52], {'highway': 'secondary', 'oneway': 'yes'}),
+    (41, [54, 53, 52], {'highway': 'secondary', 'oneway': '-1'}),
+]
+
+
+@pytest.fixture
+def pbf_path(tmp_path):
+    path = tmp_path / 'test.osm.pbf'
+    writer = osmium.SimpleWriter(str(path))
+    try:
+        for osmid, (lon, lat) in NODES.items():
+            writer.add_node(
+                osmium.osm.mutable.Node(id=osmid, location=(lon, lat)))
+        for osmid, refs, tags in WAYS:
+            writer.add_way(
+                osmium.osm.mutable.Way(id=osmid, nodes=refs, tags=tags))
+    finally:
+        writer.close()
+    return str(path)
+
+
+def test_graph_from_pbf_contracts_way_chains(pbf_path):
+    G = graph_from_pbf(pbf_path, ['primary', 'secondary', 'residential'])
+
+    # ways 10-12 are joined at nodes 2 and 4 but split at the crossing
+    # node 3, and the oneway ways are joined at 52 in their direction of
+    # travel
+    assert set(G.nodes) == {1, 3, 5, 30, 31, 50, 54}
+    assert set(G.edges(keys=False)) == {
+        (1, 3), (3, 1), (3, 5), (5, 3),
+        (30, 3), (3, 30), (3, 31), (31, 3),
+        (50, 54),
+    }
+
+    # both edges come from the chain of all three ways
+    edge = G.edges[1, 3, 0]
+    assert edge['osmid'] == [10, 11, 12]
+    assert list(edge['geometry'].coords) == [NODES[1], NODES[2], NODES[3]]
+    assert list(G.edges[5, 3, 0]['geometry'].coords) == [
+        NODES[5], NODES[4], NODES[3]
+    ]
+
+    edge = G.edges[50, 54, 0]
+    assert edge['osmid'] == [40, 41]
+    assert edge['oneway']
+    assert list(edge['geometry'].coords) == [NODES[n] for n in range(50, 55)]
+    assert edge['length'] == pytest.approx(
+        4 * G.edges[1, 3, 0]['length'] / 2, rel=1e-3)
+
+
+def test_graph_from_pbf_keeps_every_node_unsimplified(pbf_path):
+    G = graph_from_pbf(
+        pbf_path, ['primary', 'secondary', 'residential'], simplify=False)
+
+    assert set(G.nodes) == set(NODES)
+    assert (53, 52) not in G.edges
+    assert (52, 53) in G.edges
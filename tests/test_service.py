@@ -0,0 +1,71 @@
+import io
+import json
+import queue
+import threading
+
+import pytest
+
+pytest.importorskip('networkx')
+pytest.importorskip('numpy')
+pytest.importorskip('pyproj')
+pytest.importorskip('sklearn')
+geometry = pytest.importorskip('shapely.geometry')
+
+from rai.geocode import Geocoder  # noqa: E402
+from rai.service import MatchService, Region  # noqa: E402
+
+Point = geometry.Point
+
+
+class DictGeocoder(Geocoder):
+    def __init__(self, places: dict, **kwargs) -> None:
+        self.places = places
+        super().__init__(**kwargs)
+
+    def geocode(self, q):
+        return [q], [self.places[q]]
+
+
+@pytest.fixture
+def service(monkeypatch, tmp_path, make_router):
+    """A MatchService whose regions are built over a small in-memory graph
+    and geocoder instead of being loaded from disk."""
+    nodes = {'a': (0, 0), 'b': (0.1, 0)}
+
+    def init(self, name, config, batch_size=32, batch_wait=0.01):
+        self.name = name
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.max_candidate_routes = 10
+        self.length_tol = None
+        self.router = make_router(nodes, [('a', 'b')])
+        self.geocoder = DictGeocoder(
+            {q: Point(*p) for q, p in nodes.items()},
+            cache_path=tmp_path / f'{name}.geocoder.cache')
+        self.base_memory = 0
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    monkeypatch.setattr(Region, '__init__', init)
+    service = MatchService({'r1': {}})
+    yield service
+    service.close()
+
+
+def test_serve_jsonl_answers_requests_after_an_invalid_one(service):
+    fin = io.StringIO(
+        '{"id": 1, "region": ["r1"], "start": "a", "end": "b", "length": 1}\n'
+        '{"id": 2, "region": "r1", "start": "a", "end": "b", "length": 11}\n')
+    fout = io.StringIO()
+    service.serve_jsonl(fin, fout)
+
+    responses = {
+        r['id']: r
+        for r in map(json.loads,
+                     fout.getvalue().splitlines())
+    }
+    assert set(responses) == {1, 2}
+    assert responses[1]['error'].startswith('Invalid request: TypeError')
+    assert 'error' not in responses[2]
+    assert responses[2]['route_length'] == pytest.approx(11.1, abs=0.1)